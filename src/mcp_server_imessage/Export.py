@@ -0,0 +1,238 @@
+import gzip
+import json
+import os
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import IO, Any, Optional, cast
+
+from peewee import fn
+
+from .errors import ExportDependencyError, UnsupportedExportFormatError
+from .iMessage import iMessageServer
+from .SnowflakeComponents import SnowflakeDecoder
+
+__all__ = ["EXPORT_CODECS", "EXPORT_FORMATS", "ExportStats", "MessageExporter"]
+
+# Default compression for each output format
+EXPORT_FORMATS = {"ndjson": "gzip", "parquet": "zstd", "arrow": "zstd"}
+# Every compression codec each output format can write
+EXPORT_CODECS = {
+    "ndjson": ("gzip", "none"),
+    "parquet": ("zstd", "snappy", "gzip", "brotli", "lz4", "none"),
+    "arrow": ("zstd", "lz4", "none"),
+}
+STATE_FILE = ".export-state.json"
+
+# ROWID, guid, date, text, attributedBody, is_from_me, cache_roomnames, handle ROWID, handle id
+RawRow = tuple[
+    int, Optional[str], Optional[int], Optional[str], Optional[bytes], bool, Optional[str], Optional[int], Optional[str]
+]
+
+
+def decode_rows(rows: list[RawRow]) -> list[dict[str, Any]]:
+    """Decode the bodies and dates of one shard. Runs in a worker process."""
+    decoded = []
+    for rowid, guid, date, text, attributed_body, is_from_me, cache_roomnames, handle_rowid, handle_id in rows:
+        decoded.append({
+            "rowid": rowid,
+            "guid": guid,
+            "datetime": SnowflakeDecoder.decode(date).datetime_utc if date else None,
+            "body": iMessageServer._process_message_body(text, bytes(attributed_body) if attributed_body else None),
+            "phone_number": "Me" if handle_rowid is None else handle_id or "Unknown",
+            "is_from_me": bool(is_from_me),
+            "cache_roomname": cache_roomnames,
+        })
+    return decoded
+
+
+@dataclass
+class ExportStats:
+    rows: int
+    seconds: float
+    first_rowid: Optional[int] = None
+    last_rowid: Optional[int] = None
+    path: Optional[str] = None
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+class _NDJSONWriter:
+    def __init__(self, path: str, compression: str) -> None:
+        if compression == "gzip":
+            self.file = cast(IO[str], gzip.open(path, "wt", encoding="utf-8"))  # noqa: SIM115
+        elif compression == "none":
+            self.file = open(path, "w", encoding="utf-8")  # noqa: SIM115
+        else:
+            raise UnsupportedExportFormatError("ndjson", compression)
+
+    def write(self, rows: list[dict[str, Any]]) -> None:
+        for row in rows:
+            row = {**row, "datetime": row["datetime"].isoformat() if row["datetime"] else None}
+            self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class _ArrowWriter:
+    def __init__(self, path: str, fmt: str, compression: str) -> None:
+        try:
+            import pyarrow as pa
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError as err:
+            raise ExportDependencyError(fmt) from err
+
+        self.pa = pa
+        self.schema = pa.schema([
+            ("rowid", pa.int64()),
+            ("guid", pa.string()),
+            ("datetime", pa.timestamp("ms", tz="UTC")),
+            ("body", pa.string()),
+            ("phone_number", pa.string()),
+            ("is_from_me", pa.bool_()),
+            ("cache_roomname", pa.string()),
+        ])
+        codec = None if compression == "none" else compression
+        if fmt == "parquet":
+            self.writer = pa.parquet.ParquetWriter(path, self.schema, compression=codec or "none")
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=codec)
+            self.writer = pa.ipc.new_file(path, self.schema, options=options)
+
+    def write(self, rows: list[dict[str, Any]]) -> None:
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class MessageExporter:
+    """Streams the message table out of chat.db in ROWID-range shards"""
+
+    def __init__(
+        self, db_location: str = "~/Library/Messages/chat.db", shard_size: int = 5000, workers: Optional[int] = None
+    ) -> None:
+        self.server = iMessageServer(db_location)
+        self.shard_size = shard_size
+        self.workers = workers or os.cpu_count() or 1
+
+    def _rowid_bounds(self, after: int) -> Optional[tuple[int, int]]:
+        m = self.server.models
+        with self.server.connection():
+            low, high = (
+                m.Message
+                .select(fn.MIN(m.Message.ROWID), fn.MAX(m.Message.ROWID))
+                .where(after < m.Message.ROWID)
+                .scalar(as_tuple=True)
+            )
+        return None if low is None else (int(low), int(high))
+
+    def _read_shards(self, low: int, high: int) -> Iterator[list[RawRow]]:
+        m = self.server.models
+        with self.server.connection():
+            for start in range(low, high + 1, self.shard_size):
+                query = (
+                    m.Message
+                    .select(
+                        m.Message.ROWID,
+                        m.Message.guid,
+                        m.Message.date,
+                        m.Message.text,
+                        m.Message.attributedBody,
+                        m.Message.is_from_me,
+                        m.Message.cache_roomnames,
+                        m.Message.handle,
+                        m.Handle.id,
+                    )
+                    .left_outer_join(m.Handle)
+                    .where(m.Message.ROWID.between(start, start + self.shard_size - 1))
+                    .order_by(m.Message.ROWID)
+                    .tuples()
+                )
+                shard = cast(list[RawRow], list(query.iterator()))
+                if shard:
+                    yield shard
+
+    def _decode_shards(self, shards: Iterable[list[RawRow]]) -> Iterator[list[dict[str, Any]]]:
+        """Decode shards in a process pool, keeping at most two shards per worker in flight"""
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            pending: deque[Future[list[dict[str, Any]]]] = deque()
+            for shard in shards:
+                pending.append(pool.submit(decode_rows, shard))
+                if len(pending) >= self.workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    @staticmethod
+    def last_exported_rowid(output_dir: str) -> int:
+        """Return the last ROWID recorded in the export state of output_dir, or 0"""
+        try:
+            with open(os.path.join(output_dir, STATE_FILE), encoding="utf-8") as state:
+                return int(json.load(state)["last_rowid"])
+        except FileNotFoundError:
+            return 0
+
+    def export(
+        self, output_dir: str, fmt: str = "ndjson", compression: Optional[str] = None, incremental: bool = False
+    ) -> ExportStats:
+        """
+        Export messages into a new part file in output_dir.
+        Args:
+            output_dir: Directory receiving the part files and the export state
+            fmt: One of "ndjson", "parquet" or "arrow"
+            compression: Codec for the output format, defaults to the one in EXPORT_FORMATS
+            incremental: Only export messages newer than the last exported ROWID
+        Returns:
+            ExportStats describing the written part file
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise UnsupportedExportFormatError(fmt)
+        compression = compression or EXPORT_FORMATS[fmt]
+        if compression not in EXPORT_CODECS[fmt]:
+            raise UnsupportedExportFormatError(fmt, compression)
+
+        started = time.perf_counter()
+        os.makedirs(output_dir, exist_ok=True)
+        after = self.last_exported_rowid(output_dir) if incremental else 0
+        bounds = self._rowid_bounds(after)
+        if bounds is None:
+            return ExportStats(rows=0, seconds=time.perf_counter() - started)
+
+        extension = {"ndjson": "ndjson.gz" if compression == "gzip" else "ndjson", "parquet": "parquet"}.get(fmt, fmt)
+        partial_path = os.path.join(output_dir, f".messages-partial.{extension}")
+        writer = (
+            _NDJSONWriter(partial_path, compression)
+            if fmt == "ndjson"
+            else _ArrowWriter(partial_path, fmt, compression)
+        )
+
+        stats = ExportStats(rows=0, seconds=0.0)
+        try:
+            try:
+                for rows in self._decode_shards(self._read_shards(*bounds)):
+                    writer.write(rows)
+                    stats.rows += len(rows)
+                    stats.first_rowid = stats.first_rowid or rows[0]["rowid"]
+                    stats.last_rowid = rows[-1]["rowid"]
+            finally:
+                writer.close()
+        except BaseException:
+            # Leave no half written part behind, the export state still points before it
+            with suppress(FileNotFoundError):
+                os.remove(partial_path)
+            raise
+
+        stats.path = os.path.join(output_dir, f"messages-{stats.first_rowid:010d}-{stats.last_rowid:010d}.{extension}")
+        os.replace(partial_path, stats.path)
+        with open(os.path.join(output_dir, STATE_FILE), "w", encoding="utf-8") as state:
+            json.dump({"last_rowid": stats.last_rowid}, state)
+        stats.seconds = time.perf_counter() - started
+        return stats
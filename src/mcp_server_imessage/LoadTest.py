@@ -0,0 +1,401 @@
+"""Load generator driving the MCP server end to end over its real transports."""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections.abc import AsyncIterator
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import asdict, dataclass, field
+from importlib.metadata import PackageNotFoundError, version
+from typing import Any, Optional
+
+from mcp import ClientSession, StdioServerParameters, stdio_client
+from mcp.client.sse import sse_client
+from peewee import fn
+
+from .errors import UnsupportedTransportError
+from .iMessage import iMessageServer
+
+__all__ = ["LoadTestConfig", "LoadTestReport", "compare_to_baseline", "generate_chat_db", "run_load_test"]
+
+TRANSPORTS = ("stdio", "sse")
+DEFAULT_MIX = {"inbox": 5.0, "sent": 3.0, "message_context": 2.0}
+# Existing ROWIDs message_context anchors are drawn from
+ANCHOR_SAMPLE = 1000
+
+# Date of the first generated message, as stored in chat.db
+BASE_DATE = 760592585637712896
+# attributedBody framing understood by iMessageServer._process_message_body
+_BODY_PREFIX = (
+    b"\x04\x0bstreamtyped\x81\xe8\x03\x84\x01@\x84\x84\x84\x12NSAttributedString\x00\x84\x84\x08NSObject\x00"
+    b"\x85\x92\x84\x84\x84\x08NSString\x01\x94\x84\x01+"
+)
+_BODY_SUFFIX = (
+    b"\x86\x84\x02iI\x01\x0b\x92\x84\x84\x84\x0cNSDictionary\x00\x94\x84\x01i\x01\x92\x84\x96\x96"
+    b"\x1d__kIMMessagePartAttributeName\x86\x92\x84\x84\x84\x08NSNumber\x00"
+)
+
+
+def generate_chat_db(path: str, messages: int = 10000, handles: int = 50, group_chats: int = 10, seed: int = 0) -> None:
+    """
+    Create a synthetic chat.db for load testing.
+    Args:
+        path: Location of the database to create
+        messages: Number of messages to generate
+        handles: Number of distinct contacts
+        group_chats: Number of group chats
+        seed: Seed for the random generator, so runs are comparable
+    """
+    rng = random.Random(seed)  # noqa: S311
+    server = iMessageServer(path)
+    m = server.models
+    with server.connection(), server.db.atomic():
+        server.db.create_tables(m.models)
+        m.Handle.insert_many([{"id": f"+1555{index:07d}"} for index in range(handles)]).execute()
+        m.Chat.insert_many([
+            {"guid": f"iMessage;+;chat{index}", "room_name": f"chat{index}", "display_name": f"Group {index}"}
+            for index in range(group_chats)
+        ]).execute()
+
+        rows = []
+        for index in range(messages):
+            text = " ".join(rng.choice(("hey", "lunch", "tomorrow", "ok", "see", "you", "soon")) for _ in range(8))
+            # Newer macOS versions only store the body in attributedBody
+            in_blob = rng.random() < 0.5
+            encoded = text.encode()
+            rows.append({
+                "guid": f"load-{index}",
+                "handle": rng.randint(1, handles),
+                "date": BASE_DATE + ((index * 1000) << 22),
+                "text": None if in_blob else text,
+                "attributedBody": _BODY_PREFIX + bytes([len(encoded)]) + encoded + _BODY_SUFFIX if in_blob else None,
+                "is_from_me": rng.random() < 0.4,
+                "cache_roomnames": f"chat{rng.randrange(group_chats)}" if group_chats and rng.random() < 0.3 else None,
+            })
+        for start in range(0, len(rows), 500):
+            m.Message.insert_many(rows[start : start + 500]).execute()
+    server.db.close()
+
+
+@dataclass
+class LoadTestConfig:
+    db_path: str
+    transport: str = "stdio"
+    mix: dict[str, float] = field(default_factory=lambda: dict(DEFAULT_MIX))
+    # Client sessions; every stdio session runs its own server process
+    clients: int = 1
+    # Calls each session keeps in flight, so clients * concurrency calls are in flight in total
+    concurrency: int = 4
+    requests: int = 200
+    # Requests per second across all workers; 0 sends the next request as soon as a worker is free
+    rate: float = 0.0
+    seed: int = 0
+    # Seconds the server may reuse a tool result; 0 makes every request hit the database
+    result_cache_ttl: float = 0.0
+
+    @property
+    def in_flight(self) -> int:
+        return self.clients * self.concurrency
+
+
+@dataclass
+class LoadTestReport:
+    version: str
+    transport: str
+    requests: int
+    errors: int
+    seconds: float
+    throughput: float
+    latency_ms: dict[str, float]
+    tools: dict[str, dict[str, float]]
+    config: dict[str, Any]
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _latency_summary(latencies: list[float]) -> dict[str, float]:
+    millis = [latency * 1000 for latency in latencies]
+    return {"p50": percentile(millis, 50), "p90": percentile(millis, 90), "p99": percentile(millis, 99)}
+
+
+def _package_version() -> str:
+    try:
+        return version("mcp-server-imessage")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def _server_env(config: LoadTestConfig) -> dict[str, str]:
+    return {
+        **os.environ,
+        "IMESSAGE_DB_PATHS": config.db_path,
+        "IMESSAGE_RESULT_CACHE_TTL": str(config.result_cache_ttl),
+        # SSE sessions all come from this host, so let the per-client limit admit every planned call
+        "IMESSAGE_MAX_CALLS_PER_CLIENT": str(config.in_flight),
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+@asynccontextmanager
+async def _sse_server(config: LoadTestConfig) -> AsyncIterator[str]:
+    """Run the server with the SSE transport on a loopback port and yield its URL"""
+    port = _free_port()
+    command = [sys.executable, "-m", "mcp_server_imessage.server", "--transport", "sse", "--port", str(port)]
+    process = subprocess.Popen(  # noqa: S603
+        command, env=_server_env(config), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        for _ in range(200):
+            with socket.socket() as sock:
+                if sock.connect_ex(("127.0.0.1", port)) == 0:
+                    break
+            await asyncio.sleep(0.05)
+        yield f"http://127.0.0.1:{port}/sse"
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            # Open SSE streams can keep uvicorn's graceful shutdown waiting
+            process.kill()
+            process.wait()
+
+
+async def _open_sessions(stack: AsyncExitStack, config: LoadTestConfig) -> list[ClientSession]:
+    if config.transport not in TRANSPORTS:
+        raise UnsupportedTransportError(config.transport)
+
+    url = await stack.enter_async_context(_sse_server(config)) if config.transport == "sse" else None
+    sessions = []
+    for _ in range(config.clients):
+        if url is None:
+            # Every stdio client gets its own server process, as it would in practice
+            params = StdioServerParameters(
+                command=sys.executable, args=["-m", "mcp_server_imessage.server"], env=_server_env(config)
+            )
+            streams = await stack.enter_async_context(stdio_client(params))
+        else:
+            streams = await stack.enter_async_context(sse_client(url))
+        session = await stack.enter_async_context(ClientSession(*streams))
+        await session.initialize()
+        sessions.append(session)
+    return sessions
+
+
+def _sample_rowids(db_path: str, count: int) -> list[int]:
+    """Pick up to count existing ROWIDs, since a real chat.db has gaps where messages were deleted"""
+    server = iMessageServer(db_path)
+    m = server.models
+    with server.connection():
+        rowids = [row[0] for row in m.Message.select(m.Message.ROWID).order_by(fn.RANDOM()).limit(count).tuples()]
+    server.db.close()
+    # Sorted so the seeded choices only depend on which ROWIDs were sampled
+    return sorted(rowids)
+
+
+def _tool_arguments(name: str, rng: random.Random, anchors: list[int]) -> dict[str, Any]:
+    if name == "message_context":
+        return {"rowids": rng.sample(anchors, min(len(anchors), rng.randint(1, 3))), "before": 5, "after": 5}
+    return {"limit": rng.choice((10, 50, 100))}
+
+
+async def run_load_test(config: LoadTestConfig) -> LoadTestReport:
+    """
+    Drive the server with a mix of tool calls and measure latency.
+    Args:
+        config: What to run and how hard to push
+    Returns:
+        LoadTestReport with throughput, latency percentiles and per-tool error rates
+    """
+    rng = random.Random(config.seed)  # noqa: S311
+    anchors = _sample_rowids(config.db_path, ANCHOR_SAMPLE)
+
+    names = list(config.mix)
+    plan = [
+        (name, _tool_arguments(name, rng, anchors))
+        for name in rng.choices(names, weights=[config.mix[name] for name in names], k=config.requests)
+    ]
+    latencies: dict[str, list[float]] = {name: [] for name in names}
+    errors: dict[str, int] = dict.fromkeys(names, 0)
+
+    async with AsyncExitStack() as stack:
+        sessions = await _open_sessions(stack, config)
+        queue: asyncio.Queue[int] = asyncio.Queue()
+        for index in range(len(plan)):
+            queue.put_nowait(index)
+        started = time.perf_counter()
+
+        async def worker(worker_id: int) -> None:
+            session = sessions[worker_id % len(sessions)]
+            while not queue.empty():
+                index = queue.get_nowait()
+                name, arguments = plan[index]
+                # With a fixed rate, latency counts from the scheduled send time so queueing is not hidden
+                scheduled = started + index / config.rate if config.rate > 0 else time.perf_counter()
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+                try:
+                    result = await session.call_tool(name, arguments)
+                    failed = bool(result.isError)
+                except Exception:
+                    failed = True
+                latencies[name].append(time.perf_counter() - scheduled)
+                errors[name] += failed
+
+        await asyncio.gather(*(worker(worker_id) for worker_id in range(config.in_flight)))
+        seconds = time.perf_counter() - started
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    return LoadTestReport(
+        version=_package_version(),
+        transport=config.transport,
+        requests=len(all_latencies),
+        errors=sum(errors.values()),
+        seconds=seconds,
+        throughput=len(all_latencies) / seconds if seconds > 0 else 0.0,
+        latency_ms=_latency_summary(all_latencies),
+        tools={
+            name: {
+                "requests": len(latencies[name]),
+                "error_rate": errors[name] / len(latencies[name]) if latencies[name] else 0.0,
+                **_latency_summary(latencies[name]),
+            }
+            for name in names
+        },
+        config={
+            **{key: value for key, value in asdict(config).items() if key != "db_path"},
+            "in_flight": config.in_flight,
+        },
+    )
+
+
+def compare_to_baseline(report: LoadTestReport, baseline: dict[str, Any], tolerance: float = 0.2) -> list[str]:
+    """
+    Compare a report against a stored baseline report.
+    Args:
+        report: The report of the current run
+        baseline: A report previously saved with LoadTestReport.to_dict
+        tolerance: Allowed relative slowdown before a metric counts as a regression
+    Returns:
+        Human readable descriptions of every regression, empty when there is none
+    """
+    regressions = []
+    if report.throughput < baseline["throughput"] * (1 - tolerance):
+        regressions.append(f"throughput {report.throughput:.1f}/s vs {baseline['throughput']:.1f}/s")
+    for pct in ("p50", "p99"):
+        current, previous = report.latency_ms[pct], baseline["latency_ms"][pct]
+        if current > previous * (1 + tolerance):
+            regressions.append(f"{pct} latency {current:.1f}ms vs {previous:.1f}ms")
+    for name, stats in report.tools.items():
+        previous_rate = baseline["tools"].get(name, {}).get("error_rate", 0.0)
+        if stats["error_rate"] > previous_rate:
+            regressions.append(f"{name} error rate {stats['error_rate']:.1%} vs {previous_rate:.1%}")
+    return regressions
+
+
+def format_report(report: LoadTestReport) -> str:
+    lines = [
+        f"mcp-server-imessage {report.version} over {report.transport}: {report.requests} requests in"
+        f" {report.seconds:.2f}s ({report.throughput:.1f} req/s), {report.errors} errors",
+        f"{report.config.get('in_flight')} calls in flight over {report.config.get('clients')} sessions",
+        "latency p50 {p50:.1f}ms  p90 {p90:.1f}ms  p99 {p99:.1f}ms".format(**report.latency_ms),
+        f"{'tool':<18}{'requests':>10}{'errors':>10}{'p50 ms':>10}{'p99 ms':>10}",
+    ]
+    for name, stats in report.tools.items():
+        lines.append(
+            f"{name:<18}{stats['requests']:>10.0f}{stats['error_rate']:>10.1%}{stats['p50']:>10.1f}{stats['p99']:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def _parse_mix(value: str) -> dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m mcp_server_imessage.LoadTest", description=__doc__)
+    parser.add_argument("--db", help="chat.db to test against (default: generate one)")
+    parser.add_argument("--messages", type=int, default=10000, help="Messages in the generated chat.db")
+    parser.add_argument("--transport", choices=TRANSPORTS, action="append", help="Repeat to test several transports")
+    parser.add_argument("--mix", type=_parse_mix, default=DEFAULT_MIX, help="Tool weights, e.g. inbox=5,sent=3")
+    parser.add_argument("--clients", type=int, default=1, help="Client sessions (stdio: server processes)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests each session keeps in flight")
+    parser.add_argument("--requests", type=int, default=200, help="Total requests per transport")
+    parser.add_argument("--rate", type=float, default=0.0, help="Requests per second (0: as fast as possible)")
+    parser.add_argument(
+        "--result-cache-ttl", type=float, default=0.0, help="Server result cache TTL in seconds (0: disabled)"
+    )
+    parser.add_argument("--baseline", help="Compare against the reports stored in this JSON file")
+    parser.add_argument("--save-baseline", help="Store the reports of this run in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args(argv)
+
+    db_path = args.db
+    if db_path is None:
+        db_path = os.path.join(os.getcwd(), ".loadtest-chat.db")
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        generate_chat_db(db_path, messages=args.messages)
+
+    baselines = {}
+    if args.baseline and not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, skipping the comparison (create one with make loadtest-baseline)")
+    elif args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baselines = json.load(file)
+
+    reports = {}
+    regressions = []
+    for transport in args.transport or ["stdio"]:
+        config = LoadTestConfig(
+            db_path=db_path,
+            transport=transport,
+            mix=args.mix,
+            clients=args.clients,
+            concurrency=args.concurrency,
+            requests=args.requests,
+            rate=args.rate,
+            result_cache_ttl=args.result_cache_ttl,
+        )
+        report = asyncio.run(run_load_test(config))
+        reports[transport] = report.to_dict()
+        print(format_report(report))
+        if transport in baselines:
+            for regression in compare_to_baseline(report, baselines[transport], args.tolerance):
+                regressions.append(f"{transport}: {regression}")
+                print(f"REGRESSION {regressions[-1]} (baseline {baselines[transport]['version']})")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as file:
+            json.dump(reports, file, indent=2)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
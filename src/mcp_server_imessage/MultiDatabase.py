@@ -0,0 +1,134 @@
+import heapq
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from .AddressBook import AddressBook
+from .errors import MessageNotFoundException, NoDatabaseError
+from .iMessage import MessageDTO, MessageKey, iMessageServer
+from .Profiling import profiled_in_worker
+
+__all__ = ["MultiDatabaseServer"]
+
+KeyedPage = tuple[list[tuple[MessageKey, MessageDTO]], Optional[MessageKey]]
+
+
+class MultiDatabaseServer:
+    """Serves several chat.db files as one, merging their messages by date"""
+
+    serverName = "iMessage"
+
+    def __init__(
+        self, db_locations: Iterable[str], address_book: Optional[AddressBook] = None, batch_size: int = 100
+    ) -> None:
+        self.servers = [iMessageServer(db_location, address_book=address_book) for db_location in db_locations]
+        if not self.servers:
+            raise NoDatabaseError()
+        self.batch_size = batch_size
+        # One worker per database, so each database is only ever touched by its own thread and connection
+        self._executors = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"imessage-db-{index}")
+            for index in range(len(self.servers))
+        ]
+
+    def close(self) -> None:
+        """Stop the database workers"""
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+
+    def __del__(self) -> None:
+        for executor in getattr(self, "_executors", []):
+            executor.shutdown(wait=False)
+
+    def _fetch_page(
+        self, index: int, before: Optional[MessageKey], is_from_me: Optional[bool], remaining: Optional[int]
+    ) -> Future[KeyedPage]:
+        server = self.servers[index]
+        size = self.batch_size if remaining is None else min(remaining, self.batch_size)
+        return self._executors[index].submit(
+            profiled_in_worker(server.get_keyed_messages_page), before, size, is_from_me
+        )
+
+    def _stream(
+        self, index: int, is_from_me: Optional[bool], limit: Optional[int]
+    ) -> Iterator[tuple[MessageKey, MessageDTO]]:
+        """Yield at most limit messages from one database newest first, fetching the next page as this one runs out"""
+        remaining = limit
+        future: Optional[Future[KeyedPage]] = self._fetch_page(index, None, is_from_me, remaining)
+        while future is not None:
+            page, cursor = future.result()
+            future = None
+            if remaining is not None:
+                remaining -= len(page)
+            for position, (key, message) in enumerate(page, start=1):
+                # Fetch the next page while the last message of this one waits in the merge
+                if position == len(page) and cursor is not None and remaining != 0:
+                    future = self._fetch_page(index, cursor, is_from_me, remaining)
+                message.database = index
+                yield key, message
+
+    def iter_messages(self, is_from_me: Optional[bool] = None, limit: Optional[int] = None) -> Iterator[MessageDTO]:
+        """
+        Stream messages from every database, newest first.
+        Args:
+            is_from_me: Only return sent (True) or received (False) messages
+            limit: Number of messages the caller will take at most, which bounds what each database reads
+        Returns:
+            Iterator of messages merged by date, with duplicate GUIDs dropped
+        """
+        # A database never holds the same GUID twice, so none needs to read more than limit messages
+        streams = [self._stream(index, is_from_me, limit) for index in range(len(self.servers))]
+        seen_guids: set[str] = set()
+        # Merge on the key the page queries sort by, so every stream is already in merge order
+        for _, message in heapq.merge(*streams, key=lambda keyed: keyed[0], reverse=True):
+            if message.guid is not None:
+                if message.guid in seen_guids:
+                    continue
+                seen_guids.add(message.guid)
+            yield message
+
+    def _take(self, limit: Optional[int], is_from_me: Optional[bool] = None) -> list[MessageDTO]:
+        if limit is not None and limit <= 0:
+            return []
+        messages: list[MessageDTO] = []
+        for message in self.iter_messages(is_from_me, limit):
+            messages.append(message)
+            if limit is not None and len(messages) >= limit:
+                break
+        return messages
+
+    def read_messages(self, n: Optional[int] = 10) -> list[MessageDTO]:
+        return self._take(n)
+
+    def get_received_messages(self, limit: int = 100) -> list[MessageDTO]:
+        return self._take(limit, is_from_me=False)
+
+    def get_sent_messages(self, limit: int = 100) -> list[MessageDTO]:
+        return self._take(limit, is_from_me=True)
+
+    def get_message_context(
+        self, row_ids: Iterable[int], before: int = 5, after: int = 5, database: int = 0
+    ) -> dict[int, list[MessageDTO]]:
+        """
+        Fetch the messages surrounding each anchor message in its thread.
+        Args:
+            row_ids: ROWIDs of the anchor messages, which are only unique within one database
+            before: Number of earlier messages to include for each anchor
+            after: Number of later messages to include for each anchor
+            database: Index of the database holding the anchors, as set on the listed messages
+        Returns:
+            Mapping of each anchor ROWID to its window of messages, oldest first and including the anchor
+        """
+        if not 0 <= database < len(self.servers):
+            raise MessageNotFoundException()
+        server = self.servers[database]
+        contexts = (
+            self
+            ._executors[database]
+            .submit(profiled_in_worker(server.get_message_context), row_ids, before, after)
+            .result()
+        )
+        for window in contexts.values():
+            for message in window:
+                message.database = database
+        return contexts
@@ -0,0 +1,200 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Optional, TypeVar
+
+__all__ = ["PROFILE_ARGUMENT", "RequestProfiler", "profiled_in_worker"]
+
+# Tool argument that forces profiling of a single call
+PROFILE_ARGUMENT = "_profile"
+
+T = TypeVar("T")
+
+# Profiles taken on worker threads for the call being profiled on this thread
+_worker_profiles: ContextVar[Optional[list[cProfile.Profile]]] = ContextVar("_worker_profiles", default=None)
+
+
+def profiled_in_worker(func: Callable[..., T]) -> Callable[..., T]:
+    """
+    Wrap func, about to be submitted to a worker thread, so the current profiled call also covers it.
+    Before Python 3.12 cProfile only sees the thread that enabled it, so func gets its own profile
+    that is merged into the call's stats. From 3.12 the call's profile already sees every thread.
+    Args:
+        func: Function the worker thread will run
+    Returns:
+        func itself when no call is being profiled
+    """
+    profiles = _worker_profiles.get()
+    if profiles is None:
+        return func
+
+    def run(*args: Any) -> T:
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active, which from Python 3.12 already covers this thread
+            return func(*args)
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+            profiles.append(profile)
+
+    return run
+
+
+class RequestProfiler:
+    """Captures cProfile stats and tracemalloc snapshots for a sample of tool calls"""
+
+    def __init__(self, sample_rate: float = 0.0, directory: Optional[str] = None, keep: int = 20) -> None:
+        self.sample_rate = sample_rate
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "mcp-server-imessage-profiles")
+        self.keep = keep
+        # tracemalloc is process wide, so only one call is profiled at a time
+        self._lock = threading.Lock()
+        self._calls_lock = threading.Lock()
+        self._in_flight = 0
+        # Most other calls seen running while the current profile is taken, None when not profiling
+        self._concurrent_calls: Optional[int] = None
+
+    @classmethod
+    def from_env(cls) -> "RequestProfiler":
+        """Configure from IMESSAGE_PROFILE_RATE, IMESSAGE_PROFILE_DIR and IMESSAGE_PROFILE_KEEP"""
+        return cls(
+            sample_rate=float(os.environ.get("IMESSAGE_PROFILE_RATE", "0")),
+            directory=os.environ.get("IMESSAGE_PROFILE_DIR"),
+            keep=int(os.environ.get("IMESSAGE_PROFILE_KEEP", "20")),
+        )
+
+    def should_profile(self, requested: bool = False) -> bool:
+        return requested or (self.sample_rate > 0 and random.random() < self.sample_rate)  # noqa: S311
+
+    @contextmanager
+    def _counted(self) -> Iterator[None]:
+        with self._calls_lock:
+            self._in_flight += 1
+            if self._concurrent_calls is not None:
+                self._concurrent_calls = max(self._concurrent_calls, self._in_flight - 1)
+        try:
+            yield
+        finally:
+            with self._calls_lock:
+                self._in_flight -= 1
+
+    def count(self, func: Callable[..., T], *args: Any) -> T:
+        """Call func(*args), counting it as a call in flight for the profiles taken meanwhile"""
+        with self._counted():
+            return func(*args)
+
+    def run(self, name: str, arguments: dict[str, Any], func: Callable[..., T], *args: Any) -> T:
+        """
+        Call func(*args) under cProfile and tracemalloc and write the results.
+        tracemalloc, and cProfile from Python 3.12, also see the other calls running meanwhile,
+        so the metadata records how many overlapped the profile.
+        Args:
+            name: Tool name recorded with the profile
+            arguments: Tool arguments recorded with the profile
+            func: Function to profile
+        Returns:
+            Whatever func returns
+        """
+        if not self._lock.acquire(blocking=False):
+            return self.count(func, *args)
+        try:
+            with self._calls_lock:
+                self._concurrent_calls = self._in_flight
+            try:
+                with self._counted():
+                    return self._profile(name, arguments, func, *args)
+            finally:
+                with self._calls_lock:
+                    self._concurrent_calls = None
+        finally:
+            self._lock.release()
+
+    def _profile(self, name: str, arguments: dict[str, Any], func: Callable[..., T], *args: Any) -> T:
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        profile = cProfile.Profile()
+        worker_profiles: list[cProfile.Profile] = []
+        token = _worker_profiles.set(worker_profiles)
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+            _worker_profiles.reset(token)
+            seconds = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot()
+            if not tracing:
+                tracemalloc.stop()
+            self._write(
+                name,
+                arguments,
+                seconds,
+                pstats.Stats(profile).add(*list(worker_profiles)),
+                snapshot,
+                self._concurrent_calls or 0,
+            )
+
+    def _write(
+        self,
+        name: str,
+        arguments: dict[str, Any],
+        seconds: float,
+        stats: pstats.Stats,
+        snapshot: tracemalloc.Snapshot,
+        concurrent_calls: int,
+    ) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # The tool name comes from the client, so keep it to characters that are safe in a file name
+            safe_name = re.sub(r"[^A-Za-z0-9_-]", "_", name)[:64]
+            prefix = os.path.join(self.directory, f"{time.time_ns()}-{safe_name}")
+            stats.dump_stats(f"{prefix}.prof")
+            snapshot.dump(f"{prefix}.tracemalloc")
+            top_allocations = [
+                {"location": str(stat.traceback), "size": stat.size, "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:25]
+            ]
+            with open(f"{prefix}.json", "w", encoding="utf-8") as metadata:
+                json.dump(
+                    {
+                        "tool": name,
+                        "arguments": arguments,
+                        "seconds": seconds,
+                        # Other calls that ran during this profile; their allocations, and from
+                        # Python 3.12 their frames, are mixed into it
+                        "concurrent_calls": concurrent_calls,
+                        "top_allocations": top_allocations,
+                    },
+                    metadata,
+                    indent=2,
+                    default=str,
+                )
+            self._rotate()
+        except Exception:
+            logging.exception("Failed to write profile")
+
+    def _rotate(self) -> None:
+        """Delete the oldest profiles beyond the number to keep"""
+        prefixes = sorted({entry.rsplit(".", 1)[0] for entry in os.listdir(self.directory) if entry.endswith(".json")})
+        for prefix in prefixes[: max(0, len(prefixes) - self.keep)]:
+            for extension in ("json", "prof", "tracemalloc"):
+                path = os.path.join(self.directory, f"{prefix}.{extension}")
+                if os.path.exists(path):
+                    os.remove(path)
@@ -1,4 +1,5 @@
-from typing import ClassVar, cast
+import argparse
+from typing import ClassVar, Optional, cast
 
 from textual.app import App, ComposeResult
 from textual.binding import Binding
@@ -6,6 +7,7 @@ from textual.message import Message as TextualMessage
 from textual.widgets import Footer, Header, ListItem, ListView, Static
 
 from mcp_server_imessage.AddressBook import AddressBook
+from mcp_server_imessage.Export import EXPORT_FORMATS, MessageExporter
 from mcp_server_imessage.iMessage import MessageDTO, iMessageServer
 
 
@@ -116,9 +118,37 @@ class iMessageTUI(App):
             list_view.index = current - 1
 
 
-def main() -> None:
-    app = iMessageTUI()
-    app.run()
+def export(args: argparse.Namespace) -> None:
+    exporter = MessageExporter(args.db, shard_size=args.shard_size, workers=args.workers)
+    stats = exporter.export(args.output, fmt=args.format, compression=args.compression, incremental=args.incremental)
+    if stats.path is None:
+        print("No new messages to export")
+    else:
+        print(
+            f"Exported {stats.rows} messages to {stats.path} in {stats.seconds:.2f}s ({stats.rows_per_sec:,.0f} rows/sec)"
+        )
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="imessage", description="Browse and export iMessage history")
+    commands = parser.add_subparsers(dest="command")
+    export_parser = commands.add_parser("export", help="Export messages to NDJSON, Parquet or Arrow")
+    export_parser.add_argument("output", help="Directory receiving the exported files")
+    export_parser.add_argument("--db", default="~/Library/Messages/chat.db", help="Path to chat.db")
+    export_parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="ndjson")
+    export_parser.add_argument("--compression", help="Compression codec (default depends on the format)")
+    export_parser.add_argument("--shard-size", type=int, default=5000, help="ROWIDs per shard")
+    export_parser.add_argument("--workers", type=int, help="Decoding processes (default: CPU count)")
+    export_parser.add_argument(
+        "--incremental", action="store_true", help="Only export messages after the last exported ROWID"
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        export(args)
+    else:
+        app = iMessageTUI()
+        app.run()
 
 
 if __name__ == "__main__":
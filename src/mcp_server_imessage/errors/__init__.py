@@ -15,3 +15,43 @@ class MessageNotFoundException(ValueError):
 
     def __init__(self) -> None:
         super().__init__("Message not found")
+
+
+class InvalidContextSizeError(ValueError):
+    """Raised when a message context window asks for a negative or too large number of messages."""
+
+    def __init__(self, maximum: int) -> None:
+        super().__init__(f"before and after must be between 0 and {maximum}")
+
+
+class NoDatabaseError(ValueError):
+    """Raised when a server is created without any database."""
+
+    def __init__(self) -> None:
+        super().__init__("At least one database location is required")
+
+
+class UnsupportedExportFormatError(ValueError):
+    """Raised when an export format or compression codec is not supported."""
+
+    def __init__(self, fmt: str, compression: str | None = None) -> None:
+        if compression is None:
+            super().__init__(f"Unsupported export format: {fmt}")
+        else:
+            super().__init__(f"Unsupported compression for {fmt} export: {compression}")
+
+
+class ExportDependencyError(ImportError):
+    """Raised when an export format needs an optional dependency that is not installed."""
+
+    def __init__(self, fmt: str) -> None:
+        super().__init__(
+            f"Exporting to {fmt} requires pyarrow. Install it with: pip install 'mcp-server-imessage[export]'"
+        )
+
+
+class UnsupportedTransportError(ValueError):
+    """Raised when an MCP transport is not supported."""
+
+    def __init__(self, transport: str) -> None:
+        super().__init__(f"Unsupported transport: {transport}")
@@ -1,16 +1,17 @@
 import os
-from collections.abc import Iterator
+from collections.abc import Iterable, Iterator
 from contextlib import contextmanager, suppress
 from dataclasses import dataclass, fields
 from datetime import datetime
 from typing import Any, Optional, cast
 
 from peewee import DoesNotExist as PeeweeDoesNotExist
+from peewee import Expression, ModelSelect
 from playhouse.sqlite_ext import SqliteExtDatabase
 
 from .AddressBook import AddressBook
-from .errors import MessageNotFoundException
-from .models import BaseModel, Chat, Handle, Message
+from .errors import InvalidContextSizeError, MessageNotFoundException
+from .models import Message, ModelSet, bind_models
 from .SnowflakeComponents import SnowflakeDecoder
 
 
@@ -24,6 +25,8 @@ class MessageDTO:
     cache_roomname: str
     group_chat_name: str | None
     full_name: str | None = None
+    guid: str | None = None
+    database: int = 0
 
     def to_dict(self) -> dict[str, Any]:
         """Dynamically generate dictionary from dataclass fields"""
@@ -37,6 +40,13 @@ class MessageDTO:
         return result
 
 
+# Position of a message in newest-first order: (has a date, date or 0, ROWID)
+MessageKey = tuple[bool, int, int]
+
+# Most messages a context window may include on each side of its anchor
+MAX_CONTEXT_MESSAGES = 100
+
+
 class iMessageServer:
     serverName = "iMessage"
 
@@ -58,23 +68,19 @@ class iMessageServer:
 
         self.address_book = address_book
         # Initialize models before attempting any database operations
-        self._bind_models()
+        self.models = self._bind_models()
         # Only create tables for in-memory database
         if db_location == ":memory:":
             self._create_tables()
 
-    def _bind_models(self) -> None:
-        """Bind all models to the database"""
-        models = [Message, Handle, Chat]
-        for model in models:
-            model.bind(self.db)
-        BaseModel.bind(self.db)
+    def _bind_models(self) -> ModelSet:
+        """Bind a private copy of the models to the database"""
+        return bind_models(self.db)
 
     def _create_tables(self) -> None:
         """Create database tables if they don't exist"""
         with self.connection():
-            models = [Message, Handle, Chat]
-            self.db.create_tables(models, safe=True)
+            self.db.create_tables(self.models.models, safe=True)
 
     @contextmanager
     def connection(self) -> Iterator[SqliteExtDatabase]:
@@ -92,22 +98,30 @@ class iMessageServer:
             if hasattr(self, "db") and not self.db.is_closed():
                 self.db.close()
 
+    def _select_messages(self) -> ModelSelect:
+        m = self.models
+        return cast(ModelSelect, m.Message.select(m.Message, m.Handle).left_outer_join(m.Handle))
+
     def get_chat_mapping(self) -> dict[str, str]:
+        m = self.models
         with self.connection():
             return {
                 str(chat.room_name): str(chat.display_name)
-                for chat in Chat.select(Chat.room_name, Chat.display_name)
+                for chat in m.Chat.select(m.Chat.room_name, m.Chat.display_name)
                 if chat.room_name is not None
             }
 
     def get_group_chat_names(self) -> list[str]:
+        m = self.models
         with self.connection():
-            query = Message.select(Message.cache_roomnames).where(Message.cache_roomnames.is_null(False)).distinct()
+            query = (
+                m.Message.select(m.Message.cache_roomnames).where(m.Message.cache_roomnames.is_null(False)).distinct()
+            )
             return [str(msg.cache_roomnames) for msg in query]
 
     def read_messages(self, n: Optional[int] = 10) -> list[MessageDTO]:
         with self.connection():
-            query = Message.select(Message, Handle).left_outer_join(Handle).order_by(Message.date.desc())
+            query = self._select_messages().order_by(self.models.Message.date.desc())
 
             if n is not None:
                 query = query.limit(n)
@@ -120,7 +134,59 @@ class iMessageServer:
 
             return messages
 
-    def _process_message_body(self, text: Optional[str], attributed_body: Optional[bytes]) -> Optional[str]:
+    @staticmethod
+    def _message_key(db_msg: Message) -> MessageKey:
+        return (db_msg.date is not None, cast(int, db_msg.date or 0), cast(int, db_msg.ROWID))
+
+    def get_keyed_messages_page(
+        self, before: Optional[MessageKey] = None, limit: int = 100, is_from_me: Optional[bool] = None
+    ) -> tuple[list[tuple[MessageKey, MessageDTO]], Optional[MessageKey]]:
+        """
+        Fetch one page of messages, newest first, using keyset pagination.
+        Messages with a date come first, ordered by (date, ROWID), followed by messages without one, ordered by ROWID.
+        Args:
+            before: Cursor returned with the previous page, or None to start from the newest message
+            limit: Maximum number of messages in the page
+            is_from_me: Only return sent (True) or received (False) messages
+        Returns:
+            The messages with their sort keys, and the cursor for the next page or None once there are no more messages
+        """
+        m = self.models
+        query = self._select_messages()
+        if is_from_me is not None:
+            query = query.where(m.Message.is_from_me if is_from_me else ~m.Message.is_from_me)
+
+        with self.connection():
+            rows: list[Message] = []
+            if before is None or before[0]:
+                dated = query.where(m.Message.date.is_null(False))
+                if before is not None:
+                    _, before_date, before_rowid = before
+                    # The plain date bound lets SQLite range-scan the date index, the OR only breaks ties
+                    dated = dated.where(
+                        (m.Message.date <= before_date)
+                        & ((m.Message.date < before_date) | (before_rowid > m.Message.ROWID))
+                    )
+                rows = list(dated.order_by(m.Message.date.desc(), m.Message.ROWID.desc()).limit(limit))
+            if len(rows) < limit:
+                undated = query.where(m.Message.date.is_null())
+                if before is not None and not before[0]:
+                    undated = undated.where(before[2] > m.Message.ROWID)
+                rows += list(undated.order_by(m.Message.ROWID.desc()).limit(limit - len(rows)))
+            page = [(self._message_key(msg), self._create_message_from_model(msg)) for msg in rows]
+
+        cursor = page[-1][0] if len(page) == limit else None
+        return page, cursor
+
+    def get_messages_page(
+        self, before: Optional[MessageKey] = None, limit: int = 100, is_from_me: Optional[bool] = None
+    ) -> tuple[list[MessageDTO], Optional[MessageKey]]:
+        """Same as get_keyed_messages_page, without the sort keys"""
+        page, cursor = self.get_keyed_messages_page(before, limit, is_from_me)
+        return [message for _, message in page], cursor
+
+    @staticmethod
+    def _process_message_body(text: Optional[str], attributed_body: Optional[bytes]) -> Optional[str]:
         if text is not None:
             return text
         elif attributed_body is None:
@@ -142,7 +208,7 @@ class iMessageServer:
         try:
             if hasattr(db_msg, "handle") and db_msg.handle is not None:
                 try:
-                    handle = Handle.get_by_id(db_msg.handle)
+                    handle = self.models.Handle.get_by_id(db_msg.handle)
                     phone_number = handle.id if handle and handle.id else "Unknown"
                 except PeeweeDoesNotExist:
                     phone_number = "Unknown"
@@ -176,54 +242,112 @@ class iMessageServer:
             cache_roomname=str(db_msg.cache_roomnames) if db_msg.cache_roomnames else "",
             group_chat_name=mapped_name,
             full_name=full_name,
+            guid=str(db_msg.guid) if db_msg.guid else None,
         )
 
     def get_message_by_id(self, row_id: str) -> MessageDTO:
         with self.connection():
             try:
-                message = Message.select(Message, Handle).left_outer_join(Handle).where(row_id == Message.ROWID).get()
+                message = self._select_messages().where(row_id == self.models.Message.ROWID).get()
                 return self._create_message_from_model(message)
             except PeeweeDoesNotExist as err:
                 raise MessageNotFoundException() from err
 
+    def get_message_context(
+        self, row_ids: Iterable[int], before: int = 5, after: int = 5, database: int = 0
+    ) -> dict[int, list[MessageDTO]]:
+        """
+        Fetch the messages surrounding each anchor message in its thread.
+        Undated messages sort before every dated one, by ROWID, as they do in reverse page order.
+        Args:
+            row_ids: ROWIDs of the anchor messages
+            before: Number of earlier messages to include for each anchor
+            after: Number of later messages to include for each anchor
+            database: Index of the database holding the anchors, only 0 is valid for a single database
+        Returns:
+            Mapping of each anchor ROWID to its window of messages, oldest first and including the anchor
+        """
+        # SQLite reads a negative LIMIT as no limit at all
+        if not (0 <= before <= MAX_CONTEXT_MESSAGES and 0 <= after <= MAX_CONTEXT_MESSAGES):
+            raise InvalidContextSizeError(MAX_CONTEXT_MESSAGES)
+        if database != 0:
+            raise MessageNotFoundException()
+        m = self.models
+        row_ids = list(dict.fromkeys(int(row_id) for row_id in row_ids))
+        with self.connection():
+            anchors = {msg.ROWID: msg for msg in self._select_messages().where(m.Message.ROWID << row_ids)}
+            if len(anchors) != len(row_ids):
+                raise MessageNotFoundException()
+
+            contexts = {}
+            for row_id in row_ids:
+                anchor = anchors[row_id]
+                if anchor.cache_roomnames is not None:
+                    thread = m.Message.cache_roomnames == anchor.cache_roomnames
+                elif anchor.handle_id is not None:
+                    thread = (m.Message.handle == anchor.handle_id) & m.Message.cache_roomnames.is_null()
+                else:
+                    thread = m.Message.handle.is_null() & m.Message.cache_roomnames.is_null()
+                earlier, later = self._context_seeks(thread, anchor, before, after)
+                window = [*reversed(earlier), anchor, *later]
+                contexts[row_id] = [self._create_message_from_model(msg) for msg in window]
+            return contexts
+
+    def _context_seeks(
+        self, thread: Expression, anchor: Message, before: int, after: int
+    ) -> tuple[list[Message], list[Message]]:
+        """Return the messages before (newest first) and after (oldest first) anchor in its thread"""
+        m = self.models
+        row_id = anchor.ROWID
+        dated = self._select_messages().where(thread & m.Message.date.is_null(False))
+        undated = self._select_messages().where(thread & m.Message.date.is_null())
+        newest_undated_first = (m.Message.ROWID.desc(),)
+        oldest_dated_first = (m.Message.date, m.Message.ROWID)
+
+        if anchor.date is None:
+            earlier = list(undated.where(row_id > m.Message.ROWID).order_by(*newest_undated_first).limit(before))
+            later = list(undated.where(row_id < m.Message.ROWID).order_by(m.Message.ROWID).limit(after))
+            if len(later) < after:
+                later.extend(dated.order_by(*oldest_dated_first).limit(after - len(later)))
+            return earlier, later
+
+        # The plain date bounds let SQLite seek the (thread, date) index, the tie-break only filters equal dates
+        date = anchor.date
+        earlier = list(
+            dated
+            .where((m.Message.date <= date) & ((m.Message.date < date) | (row_id > m.Message.ROWID)))
+            .order_by(m.Message.date.desc(), m.Message.ROWID.desc())
+            .limit(before)
+        )
+        if len(earlier) < before:
+            earlier.extend(undated.order_by(*newest_undated_first).limit(before - len(earlier)))
+        later = list(
+            dated
+            .where((m.Message.date >= date) & ((m.Message.date > date) | (row_id < m.Message.ROWID)))
+            .order_by(*oldest_dated_first)
+            .limit(after)
+        )
+        return earlier, later
+
     def get_conversation_by_number(self, phone_number: str) -> list[MessageDTO]:
         with self.connection():
-            query = (
-                Message.select(Message, Handle)
-                .left_outer_join(Handle)
-                .where(Handle.id == phone_number)
-                .order_by(Message.date.desc())
-            )
+            m = self.models
+            query = self._select_messages().where(m.Handle.id == phone_number).order_by(m.Message.date.desc())
             return [self._create_message_from_model(msg) for msg in query]
 
     def get_group_chat_by_id(self, cache_roomnames: str) -> list[MessageDTO]:
         with self.connection():
+            m = self.models
             query = (
-                Message.select(Message, Handle)
-                .left_outer_join(Handle)
-                .where(Message.cache_roomnames == cache_roomnames)
-                .order_by(Message.date.desc())
+                self
+                ._select_messages()
+                .where(m.Message.cache_roomnames == cache_roomnames)
+                .order_by(m.Message.date.desc())
             )
             return [self._create_message_from_model(msg) for msg in query]
 
     def get_received_messages(self, limit: int = 100) -> list[MessageDTO]:
-        with self.connection():
-            query = (
-                Message.select(Message, Handle)
-                .left_outer_join(Handle)
-                .where(not Message.is_from_me)
-                .order_by(Message.date.desc())
-                .limit(limit)
-            )
-            return [self._create_message_from_model(msg) for msg in query]
+        return self.get_messages_page(limit=limit, is_from_me=False)[0]
 
     def get_sent_messages(self, limit: int = 100) -> list[MessageDTO]:
-        with self.connection():
-            query = (
-                Message.select(Message, Handle)
-                .left_outer_join(Handle)
-                .where(Message.is_from_me)
-                .order_by(Message.date.desc())
-                .limit(limit)
-            )
-            return [self._create_message_from_model(msg) for msg in query]
+        return self.get_messages_page(limit=limit, is_from_me=True)[0]
@@ -1,6 +1,7 @@
 from .base import BaseModel
+from .binding import ModelSet, bind_models
 from .chat import Chat
 from .handle import Handle
 from .message import Message
 
-__all__ = ["BaseModel", "Handle", "Chat", "Message"]
+__all__ = ["BaseModel", "Chat", "Handle", "Message", "ModelSet", "bind_models"]
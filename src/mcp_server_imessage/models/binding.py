@@ -0,0 +1,48 @@
+from dataclasses import dataclass
+from typing import Any, TypeVar, cast
+
+from peewee import Database, Field, ForeignKeyField
+
+from .base import BaseModel
+from .chat import Chat
+from .handle import Handle
+from .message import Message
+
+_M = TypeVar("_M", bound=BaseModel)
+
+
+@dataclass(frozen=True)
+class ModelSet:
+    """Model classes bound to a single database"""
+
+    database: Database
+    Message: type[Message]
+    Handle: type[Handle]
+    Chat: type[Chat]
+
+    @property
+    def models(self) -> list[type[BaseModel]]:
+        return [self.Message, self.Handle, self.Chat]
+
+
+def _bind(model: type[_M], database: Database, **fields: Field) -> type[_M]:
+    meta = type("Meta", (), {"database": database, "table_name": model._meta.table_name})  # type: ignore[attr-defined]
+    attrs: dict[str, Any] = {"Meta": meta, "__module__": model.__module__, **fields}
+    return cast(type[_M], type(model.__name__, (model,), attrs))
+
+
+def bind_models(database: Database) -> ModelSet:
+    """
+    Create copies of the models bound to the given database.
+    Args:
+        database: Database the returned models should query
+    Returns:
+        ModelSet whose models share no state with the module level models
+    """
+    bound_handle = _bind(Handle, database)
+    bound_chat = _bind(Chat, database)
+    # Inherited foreign keys still point at the module level Handle, so re-declare it
+    bound_message = _bind(
+        Message, database, handle=ForeignKeyField(bound_handle, backref="messages", null=True, field="ROWID")
+    )
+    return ModelSet(database=database, Message=bound_message, Handle=bound_handle, Chat=bound_chat)
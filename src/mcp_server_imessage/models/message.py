@@ -6,6 +6,7 @@ from .handle import Handle
 
 class Message(BaseModel):
     ROWID = AutoField()
+    guid = TextField(null=True)
     handle = ForeignKeyField(Handle, backref="messages", null=True, field="ROWID")
     date = IntegerField(null=True)
     text = TextField(null=True)
@@ -15,3 +16,9 @@ class Message(BaseModel):
 
     class Meta:
         table_name = "message"
+        # Pages seek on date and thread lookups on (thread, date), as with chat.db's own indexes
+        indexes = (
+            (("date",), False),
+            (("handle", "date"), False),
+            (("cache_roomnames", "date"), False),
+        )
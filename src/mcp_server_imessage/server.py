@@ -1,29 +1,123 @@
+import argparse
 import asyncio
+import hmac
+import ipaddress
+import json
+import logging
+import os
 import platform
-from contextlib import suppress
+import time
+import weakref
+from collections.abc import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from contextvars import ContextVar
+from typing import Any, Optional
+from urllib.parse import urlsplit
 
+import anyio
+import uvicorn
+from anyio.streams.memory import MemoryObjectReceiveStream, MemoryObjectSendStream
 from mcp import stdio_server
 from mcp.server.fastmcp import FastMCP
 from mcp.server.lowlevel import Server
-from mcp.types import TextContent, Tool
+from mcp.server.lowlevel.server import request_ctx
+from mcp.server.session import ServerSession
+from mcp.server.sse import SseServerTransport
+from mcp.shared.context import RequestContext
+from mcp.shared.exceptions import McpError
+from mcp.shared.session import RequestResponder
+from mcp.types import (
+    METHOD_NOT_FOUND,
+    ClientNotification,
+    ClientRequest,
+    ErrorData,
+    JSONRPCMessage,
+    ServerResult,
+    TextContent,
+    Tool,
+)
+from starlette.applications import Starlette
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.routing import Mount, Route
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from .AddressBook import AddressBook
-from .iMessage import iMessageServer
+from .iMessage import MAX_CONTEXT_MESSAGES, iMessageServer
+from .MultiDatabase import MultiDatabaseServer
+from .Profiling import PROFILE_ARGUMENT, RequestProfiler
 
 address_book = None
 if platform.system() == "Darwin":
     with suppress(Exception):
         address_book = AddressBook()
 
-server = iMessageServer(address_book=address_book)
+# IMESSAGE_DB_PATHS lists one chat.db, or several (separated like PATH) to serve as one merged database
+db_paths = [path for path in os.environ.get("IMESSAGE_DB_PATHS", "").split(os.pathsep) if path]
+server: iMessageServer | MultiDatabaseServer
+if len(db_paths) > 1:
+    server = MultiDatabaseServer(db_paths, address_book=address_book)
+elif db_paths:
+    server = iMessageServer(db_paths[0], address_book=address_book)
+else:
+    server = iMessageServer(address_book=address_book)
 mcp = FastMCP(server.serverName)
 
 app = Server("iMessage")
 
 
+class ResultCache:
+    """Tool results shared by every client of this process, kept for a short TTL"""
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._entries: dict[str, tuple[float, list[TextContent]]] = {}
+
+    def get(self, key: str) -> Optional[list[TextContent]]:
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def set(self, key: str, value: list[TextContent]) -> None:
+        if self.ttl <= 0:
+            return
+        # Drop expired entries so the cache cannot grow without bound
+        now = time.monotonic()
+        self._entries = {k: v for k, v in self._entries.items() if now - v[0] <= self.ttl}
+        self._entries[key] = (now, value)
+
+
+# Database calls run on a fixed set of worker threads, each keeping its own open connection
+db_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("IMESSAGE_DB_WORKERS", "4")), thread_name_prefix="imessage-db"
+)
+# Off unless configured, main() turns it on for SSE where many clients share the process
+result_cache = ResultCache(ttl=float(os.environ.get("IMESSAGE_RESULT_CACHE_TTL", "0")))
+SSE_RESULT_CACHE_TTL = 5.0
+profiler = RequestProfiler.from_env()
+max_calls_per_client = int(os.environ.get("IMESSAGE_MAX_CALLS_PER_CLIENT", "4"))
+# One semaphore per client, shared by all of its sessions and dropped when the last one closes
+_client_limits: weakref.WeakValueDictionary[str, asyncio.Semaphore] = weakref.WeakValueDictionary()
+_client_limit: ContextVar[Optional[asyncio.Semaphore]] = ContextVar("_client_limit", default=None)
+
+
+@asynccontextmanager
+async def client_limit() -> AsyncIterator[None]:
+    """Limit the number of tool calls a single client runs at once, across all of its sessions"""
+    semaphore = _client_limit.get()
+    if semaphore is None:
+        yield
+        return
+    async with semaphore:
+        yield
+
+
 @app.list_tools()
 async def list_tools() -> list[Tool]:
-    return [
+    tools = [
         Tool(
             name="inbox",
             description="Lists the messages in the inbox",
@@ -44,11 +138,53 @@ async def list_tools() -> list[Tool]:
                 },
             },
         ),
+        Tool(
+            name="message_context",
+            description="Lists the messages before and after one or more messages in the same conversation",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "rowids": {
+                        "type": "array",
+                        "items": {"type": "integer"},
+                        "description": "ROWIDs of the messages to fetch the context of",
+                    },
+                    "before": {
+                        "type": "integer",
+                        "description": "Number of earlier messages to return",
+                        "default": 5,
+                        "minimum": 0,
+                        "maximum": MAX_CONTEXT_MESSAGES,
+                    },
+                    "after": {
+                        "type": "integer",
+                        "description": "Number of later messages to return",
+                        "default": 5,
+                        "minimum": 0,
+                        "maximum": MAX_CONTEXT_MESSAGES,
+                    },
+                    "database": {
+                        "type": "integer",
+                        "description": "Database the messages were listed from, when serving several",
+                        "default": 0,
+                        "minimum": 0,
+                    },
+                },
+                "required": ["rowids"],
+            },
+        ),
     ]
+    # Every tool takes the optional profiling flag, which fetch_tool strips before running it
+    for tool in tools:
+        tool.inputSchema["properties"][PROFILE_ARGUMENT] = {
+            "type": "boolean",
+            "description": "Write a cProfile and tracemalloc profile of this call on the server",
+            "default": False,
+        }
+    return tools
 
 
-@app.call_tool()
-async def fetch_tool(name: str, arguments: dict) -> list[TextContent]:
+def run_tool(name: str, arguments: dict[str, Any]) -> list[TextContent]:
     messages = []
     if name == "inbox":
         limit = arguments.get("limit", 100)
@@ -56,17 +192,184 @@ async def fetch_tool(name: str, arguments: dict) -> list[TextContent]:
     elif name == "sent":
         limit = arguments.get("limit", 100)
         messages = server.get_sent_messages(limit=limit)
+    elif name == "message_context":
+        database = arguments.get("database", 0)
+        contexts = server.get_message_context(
+            arguments["rowids"], before=arguments.get("before", 5), after=arguments.get("after", 5), database=database
+        )
+        # One item per anchor, so batched windows can be told apart even where they overlap
+        return [
+            TextContent(
+                type="text",
+                text=json.dumps({
+                    "rowid": rowid,
+                    "database": database,
+                    "messages": [msg.to_dict() for msg in window],
+                }),
+            )
+            for rowid, window in contexts.items()
+        ]
     return [TextContent(type="text", text=msg.__str__()) for msg in messages]
 
 
+@app.call_tool()
+async def fetch_tool(name: str, arguments: dict) -> list[TextContent]:
+    profile = False
+    if PROFILE_ARGUMENT in arguments or profiler.sample_rate > 0:
+        arguments = dict(arguments)
+        profile = profiler.should_profile(bool(arguments.pop(PROFILE_ARGUMENT, False)))
+
+    key = json.dumps([name, arguments], sort_keys=True)
+    cached = result_cache.get(key)
+    # Profiled calls skip the cache so the profile shows the real work
+    if cached is not None and not profile:
+        return cached
+
+    async with client_limit():
+        loop = asyncio.get_running_loop()
+        if profile:
+            result = await loop.run_in_executor(db_executor, profiler.run, name, arguments, run_tool, name, arguments)
+        else:
+            result = await loop.run_in_executor(db_executor, profiler.count, run_tool, name, arguments)
+    result_cache.set(key, result)
+    return result
+
+
+async def _respond(session: ServerSession, responder: RequestResponder[ClientRequest, ServerResult]) -> None:
+    request = responder.request.root
+    handler = app.request_handlers.get(type(request))
+    if handler is None:
+        await responder.respond(ErrorData(code=METHOD_NOT_FOUND, message="Method not found"))
+        return
+    response: ServerResult | ErrorData
+    token = request_ctx.set(RequestContext(responder.request_id, responder.request_meta, session))
+    try:
+        response = await handler(request)
+    except McpError as err:
+        response = err.error
+    except Exception as err:
+        response = ErrorData(code=0, message=str(err))
+    finally:
+        request_ctx.reset(token)
+    await responder.respond(response)
+
+
+async def serve_session(
+    read_stream: MemoryObjectReceiveStream[JSONRPCMessage | Exception],
+    write_stream: MemoryObjectSendStream[JSONRPCMessage],
+    client: str,
+) -> None:
+    """
+    Serve one MCP session, running its requests concurrently.
+    Server.run awaits each request before reading the next, so a session would only ever have one call in flight.
+    Args:
+        read_stream: Messages from the client
+        write_stream: Messages to the client
+        client: Who the session belongs to, every session of one client shares its call limit
+    """
+    semaphore = _client_limits.setdefault(client, asyncio.Semaphore(max_calls_per_client))
+    _client_limit.set(semaphore)
+    async with (
+        ServerSession(read_stream, write_stream, app.create_initialization_options()) as session,
+        anyio.create_task_group() as requests,
+    ):
+        async for message in session.incoming_messages:
+            if isinstance(message, RequestResponder):
+                requests.start_soon(_respond, session, message)
+            elif isinstance(message, ClientNotification):
+                notification_handler = app.notification_handlers.get(type(message.root))
+                if notification_handler is not None:
+                    try:
+                        await notification_handler(message.root)
+                    except Exception:
+                        logging.exception("Notification handler failed")
+
+
 async def run_server() -> None:
     # Start server
     async with stdio_server() as streams:
-        await app.run(streams[0], streams[1], app.create_initialization_options())
+        await serve_session(streams[0], streams[1], client="stdio")
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host.strip("[]")).is_loopback
+    except ValueError:
+        return False
+
+
+class ClientGuard:
+    """
+    Only let through requests carrying the bearer token when one is set, and, on a loopback host,
+    requests whose Host and Origin name that host, which stops DNS rebinding from a browser.
+    """
+
+    def __init__(self, app: ASGIApp, host: str, port: int, token: Optional[str] = None) -> None:
+        self.app = app
+        self.token = token
+        self.allowed_hosts: Optional[set[str]] = None
+        if is_loopback(host):
+            names = {host, "localhost", "127.0.0.1", "[::1]"}
+            self.allowed_hosts = names | {f"{name}:{port}" for name in names}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+            if self.token and not hmac.compare_digest(headers.get("authorization", ""), f"Bearer {self.token}"):
+                await PlainTextResponse("Unauthorized", status_code=401)(scope, receive, send)
+                return
+            origin = headers.get("origin")
+            if self.allowed_hosts is not None and (
+                headers.get("host") not in self.allowed_hosts
+                or (origin is not None and urlsplit(origin).netloc not in self.allowed_hosts)
+            ):
+                await PlainTextResponse("Forbidden", status_code=403)(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+def create_sse_app(host: str = "127.0.0.1", port: int = 8000, token: Optional[str] = None) -> ASGIApp:
+    """Build an ASGI app serving every connected client from this process"""
+    sse = SseServerTransport("/messages/")
+
+    async def handle_sse(request: Request) -> None:
+        # Every connection from one address counts as the same client for the call limit
+        client = request.client.host if request.client else "sse"
+        async with sse.connect_sse(request.scope, request.receive, request._send) as streams:
+            await serve_session(streams[0], streams[1], client=client)
+
+    routes = [Route("/sse", endpoint=handle_sse), Mount("/messages/", app=sse.handle_post_message)]
+    return ClientGuard(Starlette(routes=routes), host, port, token)
+
+
+async def run_sse_server(host: str, port: int, token: Optional[str] = None) -> None:
+    config = uvicorn.Config(create_sse_app(host, port, token), host=host, port=port)
+    await uvicorn.Server(config).serve()
+
 
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="mcp-server-imessage", description="MCP server for iMessage")
+    parser.add_argument("--transport", choices=["stdio", "sse"], default="stdio")
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Address the SSE transport listens on, non-loopback addresses need IMESSAGE_SSE_TOKEN",
+    )
+    parser.add_argument("--port", type=int, default=8000, help="Port the SSE transport listens on")
+    args = parser.parse_args(argv)
 
-def main() -> None:
-    asyncio.run(run_server())
+    if args.transport == "sse":
+        # Clients send it as "Authorization: Bearer <token>"
+        token = os.environ.get("IMESSAGE_SSE_TOKEN") or None
+        if token is None and not is_loopback(args.host):
+            parser.error("--host must be a loopback address unless IMESSAGE_SSE_TOKEN is set")
+        if "IMESSAGE_RESULT_CACHE_TTL" not in os.environ:
+            result_cache.ttl = SSE_RESULT_CACHE_TTL
+        asyncio.run(run_sse_server(args.host, args.port, token))
+    else:
+        asyncio.run(run_server())
 
 
 if __name__ == "__main__":
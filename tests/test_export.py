@@ -0,0 +1,95 @@
+import gzip
+import json
+
+import pytest
+
+from mcp_server_imessage.__main__ import main
+from mcp_server_imessage.errors import UnsupportedExportFormatError
+from mcp_server_imessage.Export import MessageExporter, decode_rows
+from mcp_server_imessage.iMessage import iMessageServer
+
+
+def _add_messages(server, count, start=0):
+    handle = server.models.Handle.get_or_create(id="+1234567890")[0]
+    for index in range(start, start + count):
+        server.models.Message.create(
+            guid=f"guid-{index}",
+            text=f"message {index}",
+            date=760592585637712896,
+            is_from_me=index % 2 == 0,
+            handle=None if index % 2 == 0 else handle,
+        )
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "chat.db")
+    server = iMessageServer(path)
+    server.db.create_tables(server.models.models)
+    _add_messages(server, 25)
+    return path
+
+
+def _read_ndjson(path):
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_export_ndjson(db_path, tmp_path):
+    stats = MessageExporter(db_path, shard_size=10, workers=2).export(str(tmp_path / "out"))
+    assert stats.rows == 25
+    assert (stats.first_rowid, stats.last_rowid) == (1, 25)
+    rows = _read_ndjson(stats.path)
+    assert [row["rowid"] for row in rows] == list(range(1, 26))
+    assert rows[1]["body"] == "message 1"
+    assert rows[1]["phone_number"] == "+1234567890"
+    assert rows[0]["phone_number"] == "Me"
+    assert rows[0]["datetime"].startswith("2025-02-07")
+
+
+def test_export_incremental(db_path, tmp_path):
+    output = str(tmp_path / "out")
+    exporter = MessageExporter(db_path, shard_size=10, workers=1)
+    exporter.export(output, incremental=True)
+    assert exporter.export(output, incremental=True).rows == 0
+
+    _add_messages(exporter.server, 3, start=25)
+    stats = exporter.export(output, incremental=True)
+    assert (stats.rows, stats.first_rowid, stats.last_rowid) == (3, 26, 28)
+    assert MessageExporter.last_exported_rowid(output) == 28
+
+
+def test_export_parquet(db_path, tmp_path):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    stats = MessageExporter(db_path, shard_size=7, workers=2).export(str(tmp_path / "out"), fmt="parquet")
+    table = parquet.read_table(stats.path)
+    assert table.num_rows == 25
+    assert table.column("guid").to_pylist()[-1] == "guid-24"
+
+
+def test_export_unsupported_format(db_path, tmp_path):
+    with pytest.raises(UnsupportedExportFormatError):
+        MessageExporter(db_path).export(str(tmp_path / "out"), fmt="csv")
+
+
+@pytest.mark.parametrize(("fmt", "compression"), [("arrow", "gzip"), ("parquet", "bogus"), ("ndjson", "zstd")])
+def test_export_unsupported_compression(db_path, tmp_path, fmt, compression):
+    with pytest.raises(UnsupportedExportFormatError):
+        MessageExporter(db_path).export(str(tmp_path / "out"), fmt=fmt, compression=compression)
+    assert not (tmp_path / "out").exists()
+
+
+def test_export_failure_removes_partial_file(db_path, tmp_path, monkeypatch):
+    def failing_decode(self, shards):
+        yield decode_rows(next(iter(shards)))
+        raise RuntimeError
+
+    monkeypatch.setattr(MessageExporter, "_decode_shards", failing_decode)
+    with pytest.raises(RuntimeError):
+        MessageExporter(db_path, shard_size=7).export(str(tmp_path / "out"))
+    assert list((tmp_path / "out").iterdir()) == []
+
+
+def test_export_command(db_path, tmp_path, capsys):
+    main(["export", str(tmp_path / "out"), "--db", db_path, "--compression", "none", "--workers", "1"])
+    assert "Exported 25 messages" in capsys.readouterr().out
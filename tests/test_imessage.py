@@ -1,8 +1,7 @@
 import pytest
 
+from mcp_server_imessage.errors import InvalidContextSizeError, MessageNotFoundException
 from mcp_server_imessage.iMessage import MessageDTO, iMessageServer
-from mcp_server_imessage.models import Handle
-from mcp_server_imessage.models import Message as Message
 
 
 @pytest.fixture
@@ -19,10 +18,10 @@ def test_read_messages_empty(imessage_server):
 
 def test_create_and_read_message(imessage_server):
     # Create a test handle
-    handle = Handle.create(id="+1234567890", uncanonicalized_id="+1 (234) 567-890")
+    handle = imessage_server.models.Handle.create(id="+1234567890", uncanonicalized_id="+1 (234) 567-890")
 
     # Create a test message and store reference for cleanup if needed
-    Message.create(
+    imessage_server.models.Message.create(
         text="Hello, world!",
         is_from_me=False,
         date=1738899785633,  # Example timestamp
@@ -39,3 +38,75 @@ def test_create_and_read_message(imessage_server):
     assert message.body == "Hello, world!"
     assert message.phone_number == "+1234567890"
     assert not message.is_from_me
+
+
+def test_get_message_context(imessage_server):
+    models = imessage_server.models
+    alice = models.Handle.create(id="+1111111111")
+    bob = models.Handle.create(id="+2222222222")
+    alice_ids = []
+    for index in range(6):
+        alice_ids.append(
+            models.Message.create(text=f"alice {index}", date=760592585637712896 + index, handle=alice).ROWID
+        )
+        models.Message.create(text=f"bob {index}", date=760592585637712896 + index, handle=bob)
+        models.Message.create(text=f"group {index}", date=760592585637712896 + index, cache_roomnames="chat1")
+
+    contexts = imessage_server.get_message_context([alice_ids[3], alice_ids[0]], before=2, after=1)
+    assert list(contexts) == [alice_ids[3], alice_ids[0]]
+    assert [msg.body for msg in contexts[alice_ids[3]]] == ["alice 1", "alice 2", "alice 3", "alice 4"]
+    assert [msg.body for msg in contexts[alice_ids[0]]] == ["alice 0", "alice 1"]
+
+
+def test_get_message_context_group_chat(imessage_server):
+    models = imessage_server.models
+    rowids = [
+        models.Message.create(text=f"group {i}", date=760592585637712896, cache_roomnames="chat1").ROWID
+        for i in range(4)
+    ]
+    models.Message.create(text="other", date=760592585637712896, cache_roomnames="chat2")
+
+    contexts = imessage_server.get_message_context([rowids[1]], before=5, after=5)
+    assert [msg.body for msg in contexts[rowids[1]]] == ["group 0", "group 1", "group 2", "group 3"]
+
+
+def test_get_message_context_undated(imessage_server):
+    models = imessage_server.models
+    rowids = {
+        text: models.Message.create(text=text, date=date, cache_roomnames="chat1").ROWID
+        for text, date in (("dated 1", 760592585637712896 + 1), ("undated 0", None), ("dated 0", 760592585637712896))
+    }
+    models.Message.create(text="undated 1", date=None, cache_roomnames="chat1")
+
+    contexts = imessage_server.get_message_context([rowids["dated 0"], rowids["undated 0"]], before=5, after=5)
+    order = ["undated 0", "undated 1", "dated 0", "dated 1"]
+    assert [msg.body for msg in contexts[rowids["dated 0"]]] == order
+    assert [msg.body for msg in contexts[rowids["undated 0"]]] == order
+
+
+@pytest.mark.parametrize(("before", "after"), [(-1, 5), (5, -1), (101, 0)])
+def test_get_message_context_rejects_bad_sizes(imessage_server, before, after):
+    rowid = imessage_server.models.Message.create(text="only", date=760592585637712896).ROWID
+    with pytest.raises(InvalidContextSizeError):
+        imessage_server.get_message_context([rowid], before=before, after=after)
+
+
+def test_get_message_context_not_found(imessage_server):
+    with pytest.raises(MessageNotFoundException):
+        imessage_server.get_message_context([42])
+    imessage_server.models.Message.create(text="only", date=760592585637712896)
+    with pytest.raises(MessageNotFoundException):
+        imessage_server.get_message_context([1], database=1)
+
+
+def test_get_messages_page_cursor(imessage_server):
+    for date in (760592585637712896, None, 760592585637712896, None, 760592585637712896 + (1 << 22)):
+        imessage_server.models.Message.create(text=str(date), date=date)
+
+    rowids, cursor = [], None
+    while True:
+        messages, cursor = imessage_server.get_messages_page(cursor, limit=2)
+        rowids += [msg.rowid for msg in messages]
+        if cursor is None:
+            break
+    assert rowids == [5, 3, 1, 4, 2]
@@ -0,0 +1,70 @@
+import anyio
+import pytest
+
+from mcp_server_imessage.iMessage import iMessageServer
+from mcp_server_imessage.LoadTest import (
+    LoadTestConfig,
+    compare_to_baseline,
+    generate_chat_db,
+    main,
+    percentile,
+    run_load_test,
+)
+
+
+@pytest.fixture(scope="module")
+def chat_db(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("loadtest") / "chat.db")
+    generate_chat_db(path, messages=300, handles=5, group_chats=2)
+    return path
+
+
+def test_generate_chat_db(chat_db):
+    messages = iMessageServer(chat_db).read_messages(None)
+    assert len(messages) == 300
+    assert all(msg.body and "NSString" not in msg.body for msg in messages)
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 99) == 0.0
+
+
+@pytest.mark.parametrize("transport", ["stdio", "sse"])
+def test_run_load_test(chat_db, transport):
+    config = LoadTestConfig(db_path=chat_db, transport=transport, clients=2, concurrency=4, requests=30)
+    report = anyio.run(run_load_test, config)
+    assert report.requests == 30
+    assert report.errors == 0
+    assert set(report.tools) == {"inbox", "sent", "message_context"}
+    assert report.latency_ms["p50"] <= report.latency_ms["p99"]
+    assert report.config["result_cache_ttl"] == 0
+    assert report.config["in_flight"] == 8
+
+    assert compare_to_baseline(report, report.to_dict()) == []
+    slower = {**report.to_dict(), "throughput": report.throughput * 2}
+    assert compare_to_baseline(report, slower) == [
+        f"throughput {report.throughput:.1f}/s vs {slower['throughput']:.1f}/s"
+    ]
+
+
+def test_context_anchors_exist(tmp_path):
+    path = str(tmp_path / "chat.db")
+    generate_chat_db(path, messages=60, handles=3, group_chats=1)
+    server = iMessageServer(path)
+    with server.connection():
+        server.models.Message.delete().where(server.models.Message.ROWID % 2 == 0).execute()
+    server.db.close()
+
+    config = LoadTestConfig(db_path=path, mix={"message_context": 1.0}, concurrency=2, requests=10)
+    report = anyio.run(run_load_test, config)
+    assert report.requests == 10
+    assert report.errors == 0
+
+
+def test_missing_baseline_is_skipped(chat_db, tmp_path, capfd):
+    baseline = tmp_path / "baseline.json"
+    main(["--db", chat_db, "--requests", "5", "--baseline", str(baseline)])
+    assert f"No baseline at {baseline}" in capfd.readouterr().out
@@ -0,0 +1,100 @@
+import pytest
+
+from mcp_server_imessage.errors import MessageNotFoundException, NoDatabaseError
+from mcp_server_imessage.iMessage import iMessageServer
+from mcp_server_imessage.MultiDatabase import MultiDatabaseServer
+
+
+def _populate(path, rows):
+    server = iMessageServer(str(path))
+    server.db.create_tables(server.models.models)
+    handle = server.models.Handle.create(id="+1234567890")
+    for guid, date, is_from_me in rows:
+        server.models.Message.create(
+            guid=guid, text=guid, date=date, is_from_me=is_from_me, handle=None if is_from_me else handle
+        )
+    server.db.close()
+
+
+@pytest.fixture
+def multi_server(tmp_path):
+    live, backup = tmp_path / "live.db", tmp_path / "backup.db"
+    _populate(
+        live,
+        [
+            ("a", 760592585637712896, False),
+            ("c", 760592585637712896 + (2 << 22), True),
+            ("d", 760592585637712896 + (3 << 22), False),
+        ],
+    )
+    _populate(backup, [("a", 760592585637712896, False), ("b", 760592585637712896 + (1 << 22), False)])
+    server = MultiDatabaseServer([str(live), str(backup)], batch_size=1)
+    yield server
+    server.close()
+
+
+def test_requires_a_database():
+    with pytest.raises(NoDatabaseError):
+        MultiDatabaseServer([])
+
+
+def test_models_are_not_shared(multi_server):
+    live, backup = multi_server.servers
+    assert live.models.Message is not backup.models.Message
+    assert live.models.Message._meta.database is live.db
+
+
+def test_read_messages_merged_by_date(multi_server):
+    messages = multi_server.read_messages(None)
+    assert [msg.guid for msg in messages] == ["d", "c", "b", "a"]
+
+
+def test_read_messages_limit(multi_server):
+    assert [msg.guid for msg in multi_server.read_messages(2)] == ["d", "c"]
+
+
+def test_pages_are_sized_to_the_limit(tmp_path):
+    live, backup = tmp_path / "live.db", tmp_path / "backup.db"
+    _populate(live, [(f"a{i}", 760592585637712896 + (i << 22), False) for i in range(20)])
+    _populate(backup, [(f"b{i}", 760592585637712896 + (i << 22) + 1, False) for i in range(20)])
+    server = MultiDatabaseServer([str(live), str(backup)], batch_size=100)
+    requested = []
+    for database in server.servers:
+        fetch = database.get_keyed_messages_page
+
+        def recording_fetch(before, limit, is_from_me, fetch=fetch):
+            requested.append(limit)
+            return fetch(before, limit, is_from_me)
+
+        database.get_keyed_messages_page = recording_fetch
+    try:
+        assert [msg.guid for msg in server.read_messages(3)] == ["b19", "a19", "b18"]
+    finally:
+        server.close()
+    assert requested == [3, 3]
+
+
+def test_received_and_sent(multi_server):
+    assert [msg.guid for msg in multi_server.get_received_messages()] == ["d", "b", "a"]
+    assert [msg.guid for msg in multi_server.get_sent_messages()] == ["c"]
+
+
+def test_message_context_routes_to_database(multi_server):
+    messages = {msg.guid: msg for msg in multi_server.read_messages(None)}
+    assert (messages["b"].database, messages["d"].database) == (1, 0)
+
+    contexts = multi_server.get_message_context([messages["b"].rowid], database=messages["b"].database)
+    assert [(msg.guid, msg.database) for msg in contexts[messages["b"].rowid]] == [("a", 1), ("b", 1)]
+    with pytest.raises(MessageNotFoundException):
+        multi_server.get_message_context([1], database=2)
+
+
+def test_undated_messages_merge_last(tmp_path):
+    live, backup = tmp_path / "live.db", tmp_path / "backup.db"
+    _populate(live, [("a0", 760592585637712896, False), ("anull", None, False)])
+    _populate(backup, [("b0", 760592585637712896 - (1 << 22), False), ("b1", 760592585637712896 + (1 << 22), False)])
+    server = MultiDatabaseServer([str(live), str(backup)], batch_size=1)
+    try:
+        assert [msg.guid for msg in server.read_messages(None)] == ["b1", "a0", "b0", "anull"]
+    finally:
+        server.close()
@@ -0,0 +1,82 @@
+import json
+import os
+import pstats
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from mcp_server_imessage.Profiling import RequestProfiler, profiled_in_worker
+
+
+def test_sampling():
+    assert not RequestProfiler().should_profile()
+    assert RequestProfiler().should_profile(requested=True)
+    assert RequestProfiler(sample_rate=1.0).should_profile()
+
+
+def test_run_writes_profile(tmp_path):
+    profiler = RequestProfiler(directory=str(tmp_path))
+    assert profiler.run("inbox", {"limit": 10}, sorted, [3, 1, 2]) == [1, 2, 3]
+
+    (metadata_file,) = tmp_path.glob("*.json")
+    metadata = json.loads(metadata_file.read_text())
+    assert metadata["tool"] == "inbox"
+    assert metadata["arguments"] == {"limit": 10}
+    assert metadata["concurrent_calls"] == 0
+    prefix = str(metadata_file)[: -len(".json")]
+    assert pstats.Stats(f"{prefix}.prof").total_calls > 0
+    assert isinstance(tracemalloc.Snapshot.load(f"{prefix}.tracemalloc"), tracemalloc.Snapshot)
+    assert not tracemalloc.is_tracing()
+
+
+def test_profiles_rotate(tmp_path):
+    profiler = RequestProfiler(directory=str(tmp_path), keep=2)
+    for limit in range(4):
+        profiler.run("sent", {"limit": limit}, len, [])
+
+    assert len(os.listdir(tmp_path)) == 6
+    limits = sorted(json.loads(path.read_text())["arguments"]["limit"] for path in tmp_path.glob("*.json"))
+    assert limits == [2, 3]
+
+
+def test_tool_name_is_sanitized(tmp_path):
+    RequestProfiler(directory=str(tmp_path)).run("../inbox name", {}, len, [])
+
+    (metadata_file,) = tmp_path.glob("*.json")
+    assert metadata_file.name.endswith("-___inbox_name.json")
+    assert json.loads(metadata_file.read_text())["tool"] == "../inbox name"
+
+
+def _worker_sum(values):
+    return sum(values)
+
+
+def test_worker_threads_are_profiled(tmp_path):
+    assert profiled_in_worker(_worker_sum) is _worker_sum
+    with ThreadPoolExecutor(max_workers=1) as executor:
+
+        def submit_to_worker():
+            return executor.submit(profiled_in_worker(_worker_sum), [1, 2]).result()
+
+        assert RequestProfiler(directory=str(tmp_path)).run("inbox", {}, submit_to_worker) == 3
+
+    (profile_file,) = tmp_path.glob("*.prof")
+    assert "_worker_sum" in {function for _, _, function in pstats.Stats(str(profile_file)).stats}
+
+
+def test_concurrent_calls_are_recorded(tmp_path):
+    profiler = RequestProfiler(directory=str(tmp_path))
+    started, release = threading.Event(), threading.Event()
+
+    def other_call():
+        started.set()
+        release.wait(5)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        other = executor.submit(profiler.count, other_call)
+        started.wait(5)
+        profiler.run("inbox", {}, release.set)
+        other.result()
+
+    (metadata_file,) = tmp_path.glob("*.json")
+    assert json.loads(metadata_file.read_text())["concurrent_calls"] == 1
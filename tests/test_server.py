@@ -0,0 +1,190 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+import weakref
+
+import anyio
+import pytest
+import uvicorn
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from mcp_server_imessage import server as server_module
+from mcp_server_imessage.iMessage import iMessageServer
+from mcp_server_imessage.Profiling import RequestProfiler
+
+
+@pytest.fixture(scope="module")
+def sse_url(tmp_path_factory):
+    db = iMessageServer(str(tmp_path_factory.mktemp("sse") / "chat.db"))
+    db.db.create_tables(db.models.models)
+    handle = db.models.Handle.create(id="+1234567890")
+    for index in range(3):
+        db.models.Message.create(text=f"hello {index}", date=760592585637712896 + index, handle=handle)
+    db.models.Message.create(text="sent", date=760592585637712896, is_from_me=True)
+    original_server = server_module.server
+    server_module.server = db
+
+    # sse-starlette keeps process wide state bound to one event loop, so all tests share one server
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    app = server_module.create_sse_app(port=sock.getsockname()[1])
+    http = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    thread = threading.Thread(target=lambda: asyncio.run(http.serve(sockets=[sock])), daemon=True)
+    thread.start()
+    while not http.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{sock.getsockname()[1]}/sse"
+    http.should_exit = True
+    server_module.server = original_server
+
+
+async def _call(url, name, arguments):
+    async with sse_client(url) as streams, ClientSession(*streams) as session:
+        await session.initialize()
+        result = await session.call_tool(name, arguments)
+        return [content.text for content in result.content]
+
+
+def test_sse_clients_share_one_process(sse_url):
+    async def run():
+        async with anyio.create_task_group() as tg:
+            results = {}
+
+            async def call(client, name):
+                results[client] = await _call(sse_url, name, {"limit": 10})
+
+            for client in range(4):
+                tg.start_soon(call, client, "inbox" if client % 2 else "sent")
+        return results
+
+    results = anyio.run(run)
+    assert len(results[1]) == 3
+    assert "hello 2" in results[1][0]
+    assert len(results[0]) == 1
+    assert "sent" in results[0][0]
+
+
+def test_message_context_groups_by_anchor(sse_url):
+    texts = anyio.run(_call, sse_url, "message_context", {"rowids": [2, 1], "before": 1, "after": 0})
+    windows = [json.loads(text) for text in texts]
+    assert [(window["rowid"], window["database"]) for window in windows] == [(2, 0), (1, 0)]
+    assert [[msg["rowid"] for msg in window["messages"]] for window in windows] == [[1, 2], [1]]
+
+
+def test_client_call_limit(sse_url, monkeypatch):
+    in_flight, peak = [0], [0]
+    lock = threading.Lock()
+
+    def slow_tool(name, arguments):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.2)
+        with lock:
+            in_flight[0] -= 1
+        return []
+
+    monkeypatch.setattr(server_module, "run_tool", slow_tool)
+    monkeypatch.setattr(server_module, "max_calls_per_client", 3)
+    monkeypatch.setattr(server_module, "_client_limits", weakref.WeakValueDictionary())
+
+    async def session_calls(calls):
+        async with sse_client(sse_url) as streams, ClientSession(*streams) as session:
+            await session.initialize()
+            async with anyio.create_task_group() as tg:
+                for _ in range(calls):
+                    tg.start_soon(session.call_tool, "inbox", {})
+
+    async def run():
+        # One session with several calls in flight, and a second session from the same client
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(session_calls, 3)
+            tg.start_soon(session_calls, 2)
+
+    anyio.run(run)
+    assert peak[0] == 3
+
+
+def _guarded_client(host="127.0.0.1", token=None):
+    async def ok(request):
+        return PlainTextResponse("ok")
+
+    return TestClient(server_module.ClientGuard(Starlette(routes=[Route("/", ok)]), host, 8000, token))
+
+
+@pytest.mark.parametrize(
+    ("headers", "status"),
+    [
+        ({"host": "127.0.0.1:8000"}, 200),
+        ({"host": "localhost:8000", "origin": "http://localhost:8000"}, 200),
+        ({"host": "attacker.example:8000"}, 403),
+        ({"host": "127.0.0.1:8000", "origin": "http://attacker.example"}, 403),
+    ],
+)
+def test_client_guard_checks_host_and_origin(headers, status):
+    assert _guarded_client().get("/", headers=headers).status_code == status
+
+
+def test_client_guard_requires_token():
+    client = _guarded_client(host="0.0.0.0", token="secret")  # noqa: S104, S106
+    assert client.get("/", headers={"host": "mac.local:8000"}).status_code == 401
+    assert client.get("/", headers={"host": "mac.local:8000", "authorization": "Bearer secret"}).status_code == 200
+
+
+def test_non_loopback_host_requires_token(monkeypatch):
+    monkeypatch.delenv("IMESSAGE_SSE_TOKEN", raising=False)
+    with pytest.raises(SystemExit):
+        server_module.main(["--transport", "sse", "--host", "0.0.0.0"])  # noqa: S104
+
+
+def test_sse_list_tools(sse_url):
+    async def run():
+        async with sse_client(sse_url) as streams, ClientSession(*streams) as session:
+            await session.initialize()
+            return await session.list_tools()
+
+    tools = anyio.run(run).tools
+    assert {"inbox", "sent", "message_context"} <= {tool.name for tool in tools}
+    assert all(tool.inputSchema["properties"]["_profile"]["type"] == "boolean" for tool in tools)
+
+
+def test_result_cache_expires(monkeypatch):
+    cache = server_module.ResultCache(ttl=5)
+    now = [100.0]
+    monkeypatch.setattr(server_module.time, "monotonic", lambda: now[0])
+    cache.set("key", [])
+    assert cache.get("key") == []
+    now[0] += 6
+    assert cache.get("key") is None
+
+
+def test_result_cache_only_defaults_on_for_sse(monkeypatch):
+    async def run_nothing(*args):
+        pass
+
+    monkeypatch.delenv("IMESSAGE_RESULT_CACHE_TTL", raising=False)
+    monkeypatch.setattr(server_module, "run_server", run_nothing)
+    monkeypatch.setattr(server_module, "run_sse_server", run_nothing)
+    monkeypatch.setattr(server_module.result_cache, "ttl", 0.0)
+    server_module.main(["--transport", "stdio"])
+    assert server_module.result_cache.ttl == 0
+    server_module.main(["--transport", "sse"])
+    assert server_module.result_cache.ttl == server_module.SSE_RESULT_CACHE_TTL
+
+
+def test_profile_argument(sse_url, tmp_path, monkeypatch):
+    monkeypatch.setattr(server_module, "profiler", RequestProfiler(directory=str(tmp_path)))
+    texts = anyio.run(_call, sse_url, "inbox", {"limit": 2, "_profile": True})
+    assert len(texts) == 2
+
+    (metadata_file,) = tmp_path.glob("*.json")
+    metadata = json.loads(metadata_file.read_text())
+    assert metadata["tool"] == "inbox"
+    assert metadata["arguments"] == {"limit": 2}